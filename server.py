@@ -1,28 +1,89 @@
 import os
-import tempfile
 import time
 import uuid
 import base64
 import re
-import json
-from typing import Optional, Dict, Any, List
-
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from itertools import islice
+from urllib.parse import quote
+from typing import Optional, Dict, Any, List, Tuple, AsyncIterator, Deque
+
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import orjson
 from pydantic import BaseModel
-from openai import OpenAI, RateLimitError, BadRequestError
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DEFAULT_CONNECTION_LIMITS, RateLimitError, BadRequestError
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    writer = asyncio.create_task(_feedback_writer()) if FEEDBACK_STORE_PATH else None
+    prewarm = asyncio.create_task(_prewarm_tts())  # in the background: boot never waits on OpenAI
+    yield
+    prewarm.cancel()
+    if writer:
+        _feedback_q.put_nowait(None)  # drain what's queued, then stop
+        await writer
+    _close_feedback_store()
+    await client.close()  # closes the pooled httpx client too
+
 
-app = FastAPI(title="PathLight Dispatch v1")
+app = FastAPI(title="PathLight Dispatch v1", lifespan=lifespan, default_response_class=ORJSONResponse)
 
+
+class RejectOversizeUploads:
+    """
+    Rejects oversize /dispatch uploads from Content-Length alone, before the
+    multipart body is drained and spooled. Chunked uploads (no Content-Length)
+    are still caught by _check_upload_size after parsing.
+    Plain ASGI (no BaseHTTPMiddleware), so other requests and streamed
+    responses pass straight through.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/dispatch"):
+            cl = dict(scope["headers"]).get(b"content-length", b"")
+            if cl.isdigit() and int(cl) > MAX_UPLOAD_BODY_BYTES:
+                print(f"⚠️ {scope['path']} rejected content_length={cl.decode()}")
+                resp = ORJSONResponse(status_code=413, content={"detail": "Audio too large"})
+                await resp(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+# Added first so CORS wraps it and the 413 carries CORS headers
+app.add_middleware(RejectOversizeUploads)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # tighten later if you want
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Dispatch-Req-Id", "X-Dispatch-Transcript", "X-Dispatch-Reply", "X-Dispatch-Action"],
+)
+
+# Pooled HTTP/2 connections to OpenAI. Idle connections stay open for a minute
+# (httpx default is 5 s), so /dispatch reuses the TLS session that the
+# previous request or /health?warm=1 opened instead of handshaking again.
+# Limits comes from the SDK's own HTTP library (type of its default limits), and
+# the timeout stays the SDK default (600 s read, 5 s connect): a 25 MB upload can
+# take well over a minute to transcribe.
+_openai_http = DefaultAsyncHttpxClient(
+    http2=True,
+    limits=type(DEFAULT_CONNECTION_LIMITS)(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60.0),
 )
+client = AsyncOpenAI(http_client=_openai_http)  # uses OPENAI_API_KEY from env
 
-client = OpenAI()  # uses OPENAI_API_KEY from env
+# Cap on in-flight OpenAI calls per worker, so bursts queue here instead of
+# tripping the account rate limit (429s) upstream.
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+_openai_slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
 
 # -----------------------------
 # Config: Feedback visibility
@@ -37,9 +98,93 @@ FEEDBACK_STORE_PATH = os.getenv("FEEDBACK_STORE_PATH", "").strip()
 # Cap to prevent runaway memory
 MAX_FEEDBACK_ITEMS = int(os.getenv("MAX_FEEDBACK_ITEMS", "200"))
 
-# In-memory feedback store
+# In-memory feedback store (ring buffer: oldest item drops off at the cap)
 # Each item: {id, ts, note, transcript, req_id}
-FEEDBACK: List[Dict[str, Any]] = []
+FEEDBACK: Deque[Dict[str, Any]] = deque(maxlen=MAX_FEEDBACK_ITEMS)
+
+# Items waiting for the background JSONL writer (None = shut down)
+_feedback_q: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+
+# Append handle for FEEDBACK_STORE_PATH: opened on first write, kept open until
+# shutdown. Only the writer task touches it.
+_feedback_fh = None
+
+# -----------------------------
+# Config: Audio uploads
+# -----------------------------
+MAX_AUDIO_BYTES = 25 * 1024 * 1024
+# Whole multipart body: audio plus form fields and part headers
+MAX_UPLOAD_BODY_BYTES = MAX_AUDIO_BYTES + 64 * 1024
+
+# .ogg = 16 kHz mono Opus from newer headset builds (much smaller uploads)
+ALLOWED_AUDIO_EXTS = {".m4a", ".mp3", ".wav", ".webm", ".aac", ".ogg"}
+
+# -----------------------------
+# Config: Reply model
+# -----------------------------
+# Module-level constant, so the string isn't rebuilt per request. It is far
+# below OpenAI's 1024-token prompt-caching minimum; set OPENAI_PROMPT_ID
+# (below) to actually stop sending these tokens on every call.
+SYSTEM_PROMPT = (
+    "You are Dispatch inside PathLight AR. "
+    "Chelsey is blind and uses VoiceOver. "
+    "Be calm, concise, and practical. "
+    "Use short sentences. One idea per sentence. "
+    "Avoid emojis. "
+    "If the user asks for commands, briefly list: "
+    "repeat, volume up/down, set volume 60, switch voice to alloy, speech on/off, feedback colon message."
+)
+
+# Spoken when the model returns nothing
+FALLBACK_REPLY = "I’m here. What would you like to ask?"
+
+# Placeholder transcript when STT hears nothing (never parsed as a command)
+NO_SPEECH_TRANSCRIPT = "(no speech detected)"
+
+# Pilot controls the headset executes itself. Spoken on their own, they get a
+# canned confirmation instead of a model reply (no LLM round trip).
+CONTROL_ACTIONS = {"repeat_last", "help", "set_tts", "adjust_volume", "set_volume", "set_voice"}
+
+HELP_REPLY = (
+    "You can say: repeat. Volume up or down. Set volume 60. "
+    "Switch voice to alloy. Speech on or off. Or feedback, then your message."
+)
+
+# Optional stored prompt (Responses API). If set, the system prompt lives at
+# OpenAI under this id and only the user turn is sent per request.
+OPENAI_PROMPT_ID = os.getenv("OPENAI_PROMPT_ID", "").strip()
+
+# -----------------------------
+# Config: Reply audio
+# -----------------------------
+# "aac" is ~3x smaller than mp3 and decodes in hardware on iOS.
+# "opus" is smaller still but needs iOS 17+ on the headset.
+TTS_FORMAT = os.getenv("TTS_FORMAT", "aac").strip().lower()
+TTS_MIME_TYPES = {
+    "mp3": "audio/mpeg",
+    "aac": "audio/aac",
+    "opus": "audio/ogg",
+    "wav": "audio/wav",
+    "flac": "audio/flac",
+    "pcm": "audio/pcm",  # headerless 24 kHz 16-bit little-endian samples
+}
+if TTS_FORMAT not in TTS_MIME_TYPES:
+    raise RuntimeError(f"TTS_FORMAT={TTS_FORMAT!r} is not one of: {', '.join(TTS_MIME_TYPES)}")
+TTS_MIME = TTS_MIME_TYPES[TTS_FORMAT]
+
+# LRU of synthesized audio keyed by (voice, text).
+# Fallback and short stock replies repeat constantly; skip the TTS round trip for them.
+TTS_CACHE_SIZE = int(os.getenv("TTS_CACHE_SIZE", "64"))
+_TTS_CACHE: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+
+# Fixed canned phrases, synthesized once at startup for these voices and pinned
+# (never evicted) as (audio bytes, base64).
+TTS_PREWARM_VOICES = [v.strip() for v in os.getenv("TTS_PREWARM_VOICES", "nova").split(",") if v.strip()]
+_TTS_PINNED: Dict[Tuple[str, str], Tuple[bytes, str]] = {}
+
+# /health?warm=1 touches OpenAI at most once per interval
+OPENAI_WARM_INTERVAL_S = 30.0
+_last_openai_warm = 0.0
 
 
 # -----------------------------
@@ -69,86 +214,129 @@ class FeedbackItem(BaseModel):
 # -----------------------------
 # Helpers
 # -----------------------------
+# Compiled once at import; these run on every request.
+# Case-insensitive, so transcripts are scanned as-is (no lowercased copy).
+# Absolute volume, voice and feedback in one alternation = one pass over the transcript.
+# If a transcript hits several, the lowest _INTENT_PRIORITY wins, except that
+# "feedback:" claims the rest of the utterance ("feedback: volume 60" is a note).
+_INTENT_RE = re.compile(
+    # "60", "60%", "0.6", ".6", "55.5%": volume_target decides percent vs fraction
+    r"(?P<vol>volume\s*(?:to)?\s*(?P<num>[0-9]{1,3}(?:\.[0-9]+)?|\.[0-9]+)\s*%?)"
+    r"|(?P<voice>voice\s*(?:to|=)?\s*(?P<vname>[a-zA-Z0-9_-]+))"
+    # "feedback" alone, or "feedback: note" / "feedback - note"
+    r"|(?P<fb>feedback(?:\s*[:\-]\s*(?P<note>.*)$)?)",
+    re.IGNORECASE,
+)
+_INTENT_PRIORITY = {"vol": 0, "voice": 1, "fb": 2}
+# Words that may surround a command without making it a question for the model
+_COMMAND_FILLER = {"please", "ok", "okay", "hey", "now", "dispatch", "set", "use", "switch", "change", "the", "to"}
+_WORD_RE = re.compile(r"\w+")
+_SENTENCE_BREAK_RE = re.compile(r"(?<=[.!?])\s+")
+
+# Fixed-phrase intents in priority order: (phrases, action name, args).
+# If a transcript hits several groups, the earliest group wins.
+_PHRASE_INTENTS = [
+    (["repeat that", "say that again", "repeat", "again please"], "repeat_last", {}),
+    (["help", "what can i say", "commands", "pilot controls"], "help", {}),
+    (["turn off speech", "disable speech", "no speech", "mute dispatch voice"], "set_tts", {"enabled": False}),
+    (["turn on speech", "enable speech", "speech on", "unmute dispatch voice"], "set_tts", {"enabled": True}),
+    (["volume up", "turn it up", "louder"], "adjust_volume", {"delta": +0.1}),
+    (["volume down", "turn it down", "quieter"], "adjust_volume", {"delta": -0.1}),
+]
+_PHRASES = sorted(
+    ((p, i) for i, (phrases, _, _) in enumerate(_PHRASE_INTENTS) for p in phrases),
+    key=lambda pi: len(pi[0]),
+    reverse=True,
+)
+# Every phrase in one alternation (longest first) = one pass over the transcript.
+# Each phrase is its own group and m.lastindex maps back to its priority; the
+# matched text is never looked up, since IGNORECASE also matches e.g. "İ" for "i".
+_PHRASE_RE = re.compile("|".join(f"({re.escape(p)})" for p, _ in _PHRASES), re.IGNORECASE)
+_PHRASE_GROUP_PRIORITY = [None] + [i for _, i in _PHRASES]
+
+
 def clamp(v: float, lo: float, hi: float) -> float:
     return max(lo, min(hi, v))
 
 
-def extract_volume_target(text: str) -> Optional[float]:
+def volume_target(m: re.Match) -> float:
     """
-    Accepts:
+    Volume value from a "vol" _INTENT_RE match:
       - "volume 60"
       - "volume to 0.6"
       - "set volume to 70%"
-    Returns 0.0..1.0 or None.
+    Values above 1 are percent. Returns 0.0..1.0.
     """
-    t = text.lower()
+    n = float(m.group("num"))
+    if n > 1.0:
+        return clamp(n / 100.0, 0.0, 1.0)
+    return clamp(n, 0.0, 1.0)
+
 
-    m = re.search(r"(?:volume)\s*(?:to)?\s*([0-9]{1,3})\s*%?", t)
-    if m:
-        n = float(m.group(1))
-        if n > 1.0:
-            return clamp(n / 100.0, 0.0, 1.0)
-        return clamp(n, 0.0, 1.0)
+def _match_action(t: str) -> Tuple[Optional[DispatchAction], Optional[re.Match]]:
+    # Repeat, help, speech on/off, volume up/down
+    m = min(_PHRASE_RE.finditer(t), key=lambda m: _PHRASE_GROUP_PRIORITY[m.lastindex], default=None)
+    if m is not None:
+        _, name, args = _PHRASE_INTENTS[_PHRASE_GROUP_PRIORITY[m.lastindex]]
+        return DispatchAction(name=name, args=dict(args)), m
 
-    m = re.search(r"(?:volume)\s*(?:to)?\s*(0?\.\d+)", t)
-    if m:
-        return clamp(float(m.group(1)), 0.0, 1.0)
+    # Absolute volume, voice selection, feedback capture
+    m = min(_INTENT_RE.finditer(t), key=lambda m: _INTENT_PRIORITY[m.lastgroup], default=None)
+    if m is None:
+        return None, None
 
-    return None
+    if m.lastgroup == "vol":
+        return DispatchAction(name="set_volume", args={"value": volume_target(m)}), m
 
+    # Server voice, e.g. "use voice alloy" / "switch voice to nova"
+    if m.lastgroup == "voice":
+        voice = m.group("vname").strip().lower()
+        return DispatchAction(name="set_voice", args={"voice": voice}), m
 
-def parse_action(transcript: str) -> Optional[DispatchAction]:
+    # e.g. "feedback: the button is hard to tap"
+    note = m.group("note")
+    note = note.strip() if note is not None else t
+    return DispatchAction(name="save_feedback", args={"note": note}), m
+
+
+def parse_action(transcript: str) -> Tuple[Optional[DispatchAction], bool]:
     """
-    Very lightweight command detection.
-    The model still answers normally, but we optionally attach an action
-    for the headset to execute (volume, voice, repeat, etc.)
+    Very lightweight command detection. Returns (action, bare).
+    The action is attached for the headset to execute (volume, voice, repeat, etc.)
+    bare means the command is the whole utterance ("louder", "set volume to 70%"),
+    give or take filler words; only then is a pilot control confirmed without
+    asking the model. "Can you help me find the bus stop?" still gets an answer.
     """
-    t = (transcript or "").strip().lower()
-    if not t:
-        return None
+    t = (transcript or "").strip()
+    if not t or t == NO_SPEECH_TRANSCRIPT:
+        return None, False
 
-    # Repeat
-    if any(p in t for p in ["repeat that", "say that again", "repeat", "again please"]):
-        return DispatchAction(name="repeat_last", args={})
-
-    # Help
-    if any(p in t for p in ["help", "what can i say", "commands", "pilot controls"]):
-        return DispatchAction(name="help", args={})
-
-    # Speech enable/disable
-    if any(p in t for p in ["turn off speech", "disable speech", "no speech", "mute dispatch voice"]):
-        return DispatchAction(name="set_tts", args={"enabled": False})
-    if any(p in t for p in ["turn on speech", "enable speech", "speech on", "unmute dispatch voice"]):
-        return DispatchAction(name="set_tts", args={"enabled": True})
-
-    # Volume up/down
-    if any(p in t for p in ["volume up", "turn it up", "louder"]):
-        return DispatchAction(name="adjust_volume", args={"delta": +0.1})
-    if any(p in t for p in ["volume down", "turn it down", "quieter"]):
-        return DispatchAction(name="adjust_volume", args={"delta": -0.1})
-
-    # Absolute volume set
-    target = extract_volume_target(t)
-    if target is not None:
-        return DispatchAction(name="set_volume", args={"value": target})
-
-    # Voice selection (server voice)
-    # e.g. "use voice alloy" / "switch voice to nova"
-    m = re.search(r"(?:voice)\s*(?:to|=)?\s*([a-zA-Z0-9_-]+)", t)
-    if m:
-        voice = m.group(1).strip().lower()
-        return DispatchAction(name="set_voice", args={"voice": voice})
-
-    # Feedback capture
-    # e.g. "feedback: the button is hard to tap"
-    if "feedback" in t:
-        note = transcript
-        m2 = re.search(r"feedback\s*[:\-]\s*(.*)$", transcript, re.IGNORECASE)
-        if m2:
-            note = m2.group(1).strip()
-        return DispatchAction(name="save_feedback", args={"note": note})
+    action, m = _match_action(t)
+    if action is None:
+        return None, False
+
+    rest = f"{t[:m.start()]} {t[m.end():]}".casefold()
+    return action, all(w in _COMMAND_FILLER for w in _WORD_RE.findall(rest))
 
-    return None
+
+def canned_reply(action: DispatchAction) -> str:
+    """
+    Spoken confirmation for a pilot-control action (see CONTROL_ACTIONS).
+    """
+    a = action.args
+    if action.name == "help":
+        return HELP_REPLY
+    if action.name == "repeat_last":
+        return "Repeating."
+    if action.name == "set_tts":
+        return "Speech on." if a.get("enabled") else "Speech off."
+    if action.name == "adjust_volume":
+        return "Volume up." if float(a.get("delta", 0)) > 0 else "Volume down."
+    if action.name == "set_volume":
+        return f"Volume {round(float(a.get('value', 0)) * 100)} percent."
+    if action.name == "set_voice":
+        return f"Voice set to {a.get('voice', '')}."
+    return "Okay."
 
 
 def _require_feedback_token(token: Optional[str]):
@@ -158,25 +346,452 @@ def _require_feedback_token(token: Optional[str]):
 
 
 def _append_feedback(item: Dict[str, Any]):
-    FEEDBACK.append(item)
-    # Cap memory
-    if len(FEEDBACK) > MAX_FEEDBACK_ITEMS:
-        del FEEDBACK[0 : (len(FEEDBACK) - MAX_FEEDBACK_ITEMS)]
+    FEEDBACK.append(item)  # deque maxlen caps memory
+
+
+def _persist_feedback(data: bytes):
+    # Optional persistence (best effort). Blocking file I/O: the writer runs it off the event loop.
+    global _feedback_fh
+    try:
+        if _feedback_fh is None:
+            _feedback_fh = open(FEEDBACK_STORE_PATH, "ab")
+        _feedback_fh.write(data)
+        _feedback_fh.flush()
+    except Exception as e:
+        print(f"⚠️ feedback persist failed path={FEEDBACK_STORE_PATH} err={type(e).__name__} {str(e)[:200]}")
+
+
+async def _feedback_writer():
+    """
+    Single background writer for FEEDBACK_STORE_PATH.
+    Everything queued since the last write goes out as one write.
+    """
+    while True:
+        batch = [await _feedback_q.get()]
+        while not _feedback_q.empty():
+            batch.append(_feedback_q.get_nowait())
+
+        items = [i for i in batch if i is not None]
+        if items:
+            data = b"".join(orjson.dumps(i, option=orjson.OPT_APPEND_NEWLINE) for i in items)
+            await asyncio.to_thread(_persist_feedback, data)
+
+        if len(items) < len(batch):
+            return
+
+
+def _close_feedback_store():
+    global _feedback_fh
+    if _feedback_fh is not None:
+        _feedback_fh.close()
+        _feedback_fh = None
+
+
+def _save_feedback_action(action: Optional[DispatchAction], transcript: str, req_id: str):
+    """
+    If save_feedback, store it in memory immediately (so we never “lose” it)
+    and queue it for the background disk writer.
+    """
+    if not action or action.name != "save_feedback":
+        return
+    note = str(action.args.get("note", "")).strip() or transcript
+    item = {
+        "id": req_id,  # one feedback item per request
+        "ts": time.time(),
+        "note": note,
+        "transcript": transcript,
+        "req_id": req_id,
+    }
+    _append_feedback(item)
+    print(f"📝 feedback saved id={req_id} note={note[:140]}")
 
-    # Optional persistence (best effort)
     if FEEDBACK_STORE_PATH:
+        _feedback_q.put_nowait(item)
+
+
+async def _warm_openai():
+    """
+    Cheap authenticated call so the SDK's connection pool (TCP + TLS) is open
+    before the next /dispatch. Best effort, throttled.
+    """
+    global _last_openai_warm
+    now = time.monotonic()
+    if now - _last_openai_warm < OPENAI_WARM_INTERVAL_S:
+        return
+    _last_openai_warm = now
+
+    try:
+        await client.models.list()
+    except Exception as e:
+        print(f"⚠️ openai warm failed err={type(e).__name__} {str(e)[:200]}")
+
+
+def _check_upload_ext(audio: UploadFile):
+    if not audio.filename:
+        raise HTTPException(status_code=400, detail="Missing audio file")
+
+    ext = os.path.splitext(audio.filename)[1].lower()
+    if ext not in ALLOWED_AUDIO_EXTS:
+        raise HTTPException(status_code=415, detail=f"Unsupported file extension: {ext or '(none)'}")
+
+
+def _check_upload_size(audio: UploadFile):
+    size = audio.size
+    if size is None:
+        audio.file.seek(0, os.SEEK_END)
+        size = audio.file.tell()
+    if size > MAX_AUDIO_BYTES:
+        raise HTTPException(status_code=413, detail="Audio too large")
+
+
+async def _transcribe(audio: UploadFile) -> str:
+    """
+    Hands Starlette's already-spooled upload straight to the SDK:
+    no extra read into memory, no temp file.
+    """
+    await audio.seek(0)
+    async with _openai_slots:
+        tx = await client.audio.transcriptions.create(
+            model="gpt-4o-mini-transcribe",
+            file=(audio.filename, audio.file, audio.content_type or "audio/mp4"),
+        )
+    return (getattr(tx, "text", "") or "").strip() or NO_SPEECH_TRANSCRIPT
+
+
+def _reply_request(transcript: str, mode: str) -> Dict[str, Any]:
+    """
+    Keyword args for client.responses.create.
+    """
+    user_prompt = transcript if (not mode or mode == "talk") else f"[mode={mode}] {transcript}"
+
+    if OPENAI_PROMPT_ID:
+        # extra_body works on every SDK version that has the Responses API
+        return {
+            "model": "gpt-4o-mini",
+            "input": [{"role": "user", "content": user_prompt}],
+            "extra_body": {"prompt": {"id": OPENAI_PROMPT_ID}},
+        }
+
+    return {
+        "model": "gpt-4o-mini",
+        "input": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": user_prompt},
+        ],
+    }
+
+
+def _http_error(route: str, req_id: str, e: Exception) -> HTTPException:
+    """
+    Maps an upstream failure to the HTTPException we return to the headset.
+    """
+    if isinstance(e, RateLimitError):
+        print(f"⚠️ {route} req_id={req_id} rate_limited")
+        return HTTPException(status_code=429, detail="Dispatch is busy. Please try again in a moment.")
+
+    if isinstance(e, BadRequestError):
+        # Voice/param issues — prints exact error to Render logs.
+        print(f"❌ {route} req_id={req_id} bad_request: {e}")
+        return HTTPException(status_code=400, detail="Bad request to speech service")
+
+    if isinstance(e, HTTPException):
+        print(f"⚠️ {route} req_id={req_id} HTTPException")
+        return e
+
+    print(f"❌ {route} req_id={req_id} error={type(e).__name__} msg={str(e)[:200]}")
+    return HTTPException(status_code=500, detail=f"Dispatch error: {type(e).__name__}")
+
+
+def split_sentences(buf: str) -> Tuple[List[str], str]:
+    """
+    Splits streamed reply text on sentence boundaries (.!? followed by whitespace).
+    Returns (complete sentences, unfinished tail).
+    """
+    parts = _SENTENCE_BREAK_RE.split(buf)
+    return [p.strip() for p in parts[:-1] if p.strip()], parts[-1]
+
+
+async def _multipart_body(
+    boundary: str,
+    meta: Dict[str, Any],
+    audio_chunks: Optional[AsyncIterator[bytes]],
+    audio_mime: Optional[str],
+) -> AsyncIterator[bytes]:
+    """
+    multipart/mixed body: a JSON part (transcript/reply/action), then the raw
+    audio part when there is one, forwarded chunk by chunk. No base64 anywhere.
+    """
+    yield f"--{boundary}\r\nContent-Type: application/json; charset=utf-8\r\n\r\n".encode("ascii")
+    yield orjson.dumps(meta)
+    if audio_chunks is not None:
+        yield f"\r\n--{boundary}\r\nContent-Type: {audio_mime}\r\n\r\n".encode("ascii")
+        async for chunk in audio_chunks:
+            yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode("ascii")
+
+
+def _negotiate_body(accept: Optional[str], want_tts: bool) -> str:
+    """
+    Picks the /dispatch response body from the Accept header:
+      "multipart" - JSON part + raw audio part
+      "audio"     - raw audio body, metadata in X-Dispatch-* headers (only with tts)
+      "json"      - DispatchOut with base64 audio (default; what older headsets expect)
+    """
+    a = (accept or "").lower()
+    if "multipart/mixed" in a:
+        return "multipart"
+    if want_tts and "audio/" in a:
+        return "audio"
+    return "json"
+
+
+def _meta_headers(req_id: str, out: DispatchOut) -> Dict[str, str]:
+    """
+    transcript/reply/action for raw-audio responses.
+    Percent-encoded UTF-8, since header values must be latin-1.
+    """
+    return {
+        "X-Dispatch-Req-Id": req_id,
+        "X-Dispatch-Transcript": quote(out.transcript),
+        "X-Dispatch-Reply": quote(out.reply),
+        "X-Dispatch-Action": quote(orjson.dumps(out.action.model_dump())) if out.action else "",
+    }
+
+
+def _ndjson(frame: Dict[str, Any]) -> bytes:
+    return orjson.dumps(frame, option=orjson.OPT_APPEND_NEWLINE)
+
+
+async def _tts_fetch(voice: str, text: str) -> bytes:
+    async with _openai_slots:
+        tts_resp = await client.audio.speech.create(
+            model="gpt-4o-mini-tts",
+            voice=voice,
+            input=text,
+            response_format=TTS_FORMAT,  # correct param name
+        )
+        return await tts_resp.aread()
+
+
+def _tts_cache_get(key: Tuple[str, str]) -> Optional[bytes]:
+    # Pinned canned phrases first, then the LRU
+    pinned = _TTS_PINNED.get(key)
+    if pinned is not None:
+        return pinned[0]
+
+    audio_bytes = _TTS_CACHE.get(key)
+    if audio_bytes is not None:
+        _TTS_CACHE.move_to_end(key)
+    return audio_bytes
+
+
+def _tts_cache_put(key: Tuple[str, str], audio_bytes: bytes):
+    _TTS_CACHE[key] = audio_bytes
+    if len(_TTS_CACHE) > TTS_CACHE_SIZE:
+        _TTS_CACHE.popitem(last=False)
+
+
+async def _synthesize(voice: str, text: str) -> bytes:
+    """
+    Reply text -> audio bytes, through the TTS caches.
+    """
+    key = (voice, text)
+    audio_bytes = _tts_cache_get(key)
+    if audio_bytes is None:
+        audio_bytes = await _tts_fetch(voice, text)
+        _tts_cache_put(key, audio_bytes)
+    return audio_bytes
+
+
+async def _tts_chunks(voice: str, text: str) -> AsyncIterator[bytes]:
+    """
+    Reply text -> audio chunks, forwarded as OpenAI produces them.
+    Yields b"" once the upstream response is open (see _open_tts_stream).
+    Cache hits come out as one chunk; misses are cached once complete.
+    """
+    key = (voice, text)
+    cached = _tts_cache_get(key)
+    if cached is not None:
+        yield b""
+        yield cached
+        return
+
+    # The slot covers the call until OpenAI answers, not the body relay after it:
+    # that runs at the client's download pace, and a slow cellular link must not
+    # hold a slot. The cap therefore bounds calls being started; bodies still in
+    # flight are bounded by the httpx pool instead.
+    async with _openai_slots:
+        tts_stream = client.audio.speech.with_streaming_response.create(
+            model="gpt-4o-mini-tts",
+            voice=voice,
+            input=text,
+            response_format=TTS_FORMAT,
+        )
+        tts_resp = await tts_stream.__aenter__()
+
+    buf = bytearray()
+    try:
+        yield b""
+        async for chunk in tts_resp.iter_bytes():
+            buf += chunk
+            yield chunk
+    finally:
+        await tts_stream.__aexit__(None, None, None)
+
+    _tts_cache_put(key, bytes(buf))
+
+
+async def _open_tts_stream(voice: str, text: str) -> AsyncIterator[bytes]:
+    """
+    Runs _tts_chunks until OpenAI has answered, so upstream errors (429, bad
+    voice) raise here, inside the route, instead of mid-response.
+    """
+    chunks = _tts_chunks(voice, text)
+    await chunks.__anext__()
+    return chunks
+
+
+def _audio_b64(voice: str, text: str, audio_bytes: bytes) -> str:
+    pinned = _TTS_PINNED.get((voice, text))
+    if pinned is not None:
+        return pinned[1]
+    return base64.b64encode(audio_bytes).decode("ascii")
+
+
+async def _tts_b64(voice: str, text: str) -> str:
+    audio_bytes = await _synthesize(voice, text)
+    return _audio_b64(voice, text, audio_bytes)
+
+
+async def _prewarm_tts():
+    """
+    Pins audio for every fixed canned reply (one per phrase intent, plus the
+    fallback) for TTS_PREWARM_VOICES, so those replies never call OpenAI.
+    Best effort: a failed phrase is just synthesized on demand later.
+    """
+    phrases = [canned_reply(DispatchAction(name=name, args=args)) for _, name, args in _PHRASE_INTENTS]
+    phrases.append(FALLBACK_REPLY)
+
+    async def pin(voice: str, text: str):
         try:
-            with open(FEEDBACK_STORE_PATH, "a", encoding="utf-8") as f:
-                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+            audio_bytes = await _tts_fetch(voice, text)
         except Exception as e:
-            print(f"⚠️ feedback persist failed path={FEEDBACK_STORE_PATH} err={type(e).__name__} {str(e)[:200]}")
+            print(f"⚠️ tts prewarm failed voice={voice} text={text[:40]} err={type(e).__name__} {str(e)[:200]}")
+            return
+        _TTS_PINNED[(voice, text)] = (audio_bytes, base64.b64encode(audio_bytes).decode("ascii"))
+
+    await asyncio.gather(*(pin(v, t) for v in TTS_PREWARM_VOICES for t in dict.fromkeys(phrases)))
+    print(f"🔊 tts prewarm done pinned={len(_TTS_PINNED)} voices={','.join(TTS_PREWARM_VOICES)}")
+
+
+async def _stream_reply(
+    req_id: str,
+    t0: float,
+    transcript: str,
+    action: Optional[DispatchAction],
+    canned: bool,
+    mode: str,
+    voice: str,
+    want_tts: bool,
+) -> AsyncIterator[bytes]:
+    """
+    LLM -> TTS pipeline for /dispatch/stream.
+    Each finished sentence is sent to TTS right away, so speech for sentence 1
+    is synthesized while the model is still writing sentence 2.
+    Audio frames are always emitted in sentence order.
+    """
+    yield _ndjson({
+        "type": "transcript",
+        "transcript": transcript,
+        "action": action.model_dump() if action else None,
+    })
+
+    pending: List[asyncio.Task] = []
+    seq = 0
+    buf = ""
+    reply = ""
+
+    def schedule(sentence: str):
+        if want_tts:
+            pending.append(asyncio.create_task(_tts_b64(voice, sentence)))
+
+    def audio_frame(audio_b64: str) -> bytes:
+        nonlocal seq
+        seq += 1
+        return _ndjson({"type": "audio_chunk_b64", "seq": seq, "audio_b64": audio_b64, "audio_mime": TTS_MIME})
+
+    try:
+        if canned:
+            # Bare pilot control: canned confirmation, no model call
+            reply = canned_reply(action)
+            yield _ndjson({"type": "text_delta", "delta": reply})
+            schedule(reply)
+
+        else:
+            # The slot covers opening the stream only. Deltas are yielded at the
+            # client's download pace, so holding it here would let slow links
+            # eat the cap; in-flight streams are bounded by the httpx pool.
+            async with _openai_slots:
+                stream = await client.responses.create(**_reply_request(transcript, mode), stream=True)
+
+            # Closed on error or client disconnect too, so the upstream connection goes back to the pool
+            async with stream:
+                async for event in stream:
+                    if event.type != "response.output_text.delta":
+                        continue
+
+                    reply += event.delta
+                    yield _ndjson({"type": "text_delta", "delta": event.delta})
+
+                    sentences, buf = split_sentences(buf + event.delta)
+                    for sentence in sentences:
+                        schedule(sentence)
+
+                    # Flush whatever audio is already done, without waiting
+                    while pending and pending[0].done():
+                        yield audio_frame(pending.pop(0).result())
+
+            reply = reply.strip()
+            if not reply:
+                reply = FALLBACK_REPLY
+                yield _ndjson({"type": "text_delta", "delta": reply})
+                schedule(reply)
+            elif buf.strip():
+                schedule(buf.strip())
+
+        while pending:
+            yield audio_frame(await pending.pop(0))
+
+        dt_ms = int((time.time() - t0) * 1000)
+        print(
+            f"✅ /dispatch/stream req_id={req_id} mode={mode} ms={dt_ms} "
+            f"transcript_len={len(transcript)} reply_len={len(reply)} "
+            f"tts={want_tts} voice={voice} audio_fmt={TTS_FORMAT} audio_chunks={seq} "
+            f"action={(action.name if action else 'none')}"
+        )
+        yield _ndjson({"type": "done", "reply": reply})
+
+    except Exception as e:
+        err = _http_error("/dispatch/stream", req_id, e)
+        yield _ndjson({"type": "error", "status": err.status_code, "detail": err.detail})
+
+    finally:
+        for task in pending:
+            task.cancel()
 
 
 # -----------------------------
 # Routes
 # -----------------------------
 @app.get("/health")
-def health():
+async def health(warm: bool = Query(default=False)):
+    """
+    Liveness check.
+    The headset calls /health?warm=1 when the mic is armed, so a cold dyno boots
+    and the OpenAI connection opens while the user is still talking.
+    """
+    if warm:
+        await _warm_openai()
     return {"ok": True}
 
 
@@ -190,8 +805,7 @@ def list_feedback(
     Optional token gate via FEEDBACK_TOKEN env var.
     """
     _require_feedback_token(token)
-    items = FEEDBACK[-limit:]
-    return items[::-1]  # newest first
+    return list(islice(reversed(FEEDBACK), limit))  # newest first
 
 
 @app.get("/feedback/latest", response_model=Optional[FeedbackItem])
@@ -211,102 +825,69 @@ async def dispatch(
     audio: UploadFile = File(...),
     voice: str = Form("nova"),          # server TTS voice
     tts: str = Form("1"),               # "1" = return audio, "0" = text-only
+    accept: Optional[str] = Header(default=None),
 ):
-    req_id = str(uuid.uuid4())
+    """
+    Default response is DispatchOut JSON with base64 audio.
+    No-base64 alternatives, chosen by Accept:
+      multipart/mixed -> JSON part plus a raw audio part
+      audio/*         -> raw audio body; transcript/reply/action in X-Dispatch-* headers
+    """
+    req_id = uuid.uuid4().hex
     t0 = time.time()
 
-    if not audio.filename:
-        raise HTTPException(status_code=400, detail="Missing audio file")
-
-    ext = os.path.splitext(audio.filename)[1].lower()
-    if ext not in {".m4a", ".mp3", ".wav", ".webm", ".aac"}:
-        raise HTTPException(status_code=415, detail=f"Unsupported file extension: {ext or '(none)'}")
+    _check_upload_ext(audio)
 
-    tmp_path = None
     try:
-        contents = await audio.read()
-        if len(contents) > 25 * 1024 * 1024:
-            raise HTTPException(status_code=413, detail="Audio too large")
-
-        with tempfile.NamedTemporaryFile(delete=False, suffix=ext or ".m4a") as tmp:
-            tmp_path = tmp.name
-            tmp.write(contents)
+        _check_upload_size(audio)
 
         # 1) Speech -> Text
-        with open(tmp_path, "rb") as f:
-            tx = client.audio.transcriptions.create(
-                model="gpt-4o-mini-transcribe",
-                file=f,
-            )
-
-        transcript = (getattr(tx, "text", "") or "").strip() or "(no speech detected)"
+        transcript = await _transcribe(audio)
 
         # 2) Decide if this is a pilot-control command
-        action = parse_action(transcript)
-
-        # 2b) If save_feedback, store it immediately (so we never “lose” it)
-        if action and action.name == "save_feedback":
-            note = str(action.args.get("note", "")).strip() or transcript
-            item = {
-                "id": str(uuid.uuid4()),
-                "ts": time.time(),
-                "note": note,
-                "transcript": transcript,
-                "req_id": req_id,
-            }
-            _append_feedback(item)
-            print(f"📝 feedback saved id={item['id']} req_id={req_id} note={note[:140]}")
-
-        # 3) Text -> Reply
-        system_prompt = (
-            "You are Dispatch inside PathLight AR. "
-            "Chelsey is blind and uses VoiceOver. "
-            "Be calm, concise, and practical. "
-            "Use short sentences. One idea per sentence. "
-            "Avoid emojis. "
-            "If the user asks for commands, briefly list: "
-            "repeat, volume up/down, set volume 60, switch voice to alloy, speech on/off, feedback colon message."
-        )
+        action, bare = parse_action(transcript)
 
-        user_prompt = transcript if (not mode or mode == "talk") else f"[mode={mode}] {transcript}"
+        # 2b) If save_feedback, store it now (disk write happens in the background)
+        _save_feedback_action(action, transcript, req_id)
 
-        resp = client.responses.create(
-            model="gpt-4o-mini",
-            input=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-        )
+        # 3) Text -> Reply (a bare pilot control gets a canned confirmation, no model call)
+        canned = bool(action and bare and action.name in CONTROL_ACTIONS)
+        if canned:
+            reply = canned_reply(action)
+        else:
+            async with _openai_slots:
+                resp = await client.responses.create(**_reply_request(transcript, mode))
 
-        reply = (getattr(resp, "output_text", "") or "").strip() or "I’m here. What would you like to ask?"
+            reply = (getattr(resp, "output_text", "") or "").strip() or FALLBACK_REPLY
 
         # 4) Reply -> Speech (optional)
         want_tts = (tts.strip() != "0")
+        body = _negotiate_body(accept, want_tts)
+        audio_chunks = None
         audio_b64 = None
         audio_mime = None
         audio_size = 0
 
         if want_tts:
-            tts_resp = client.audio.speech.create(
-                model="gpt-4o-mini-tts",
-                voice=voice,
-                input=reply,
-                response_format="mp3",  # correct param name
-            )
-            audio_bytes = tts_resp.read()
-            audio_size = len(audio_bytes)
-            audio_b64 = base64.b64encode(audio_bytes).decode("utf-8")
-            audio_mime = "audio/mpeg"
+            audio_mime = TTS_MIME
+            if body == "json":
+                audio_bytes = await _synthesize(voice, reply)
+                audio_size = len(audio_bytes)
+                audio_b64 = _audio_b64(voice, reply, audio_bytes)
+            else:
+                # Binary bodies forward TTS chunks as they arrive (size unknown up front)
+                audio_chunks = await _open_tts_stream(voice, reply)
 
         dt_ms = int((time.time() - t0) * 1000)
         print(
             f"✅ /dispatch req_id={req_id} mode={mode} ms={dt_ms} "
             f"transcript_len={len(transcript)} reply_len={len(reply)} "
-            f"tts={want_tts} voice={voice} audio_bytes={audio_size} "
-            f"action={(action.name if action else 'none')}"
+            f"tts={want_tts} voice={voice} audio_fmt={TTS_FORMAT} "
+            f"audio_bytes={'streamed' if audio_chunks else audio_size} "
+            f"body={body} canned={canned} action={(action.name if action else 'none')}"
         )
 
-        return DispatchOut(
+        out = DispatchOut(
             transcript=transcript,
             reply=reply,
             audio_b64=audio_b64,
@@ -314,26 +895,53 @@ async def dispatch(
             action=action,
         )
 
-    except RateLimitError:
-        print(f"⚠️ /dispatch req_id={req_id} rate_limited")
-        raise HTTPException(status_code=429, detail="Dispatch is busy. Please try again in a moment.")
+        if body == "audio":
+            return StreamingResponse(audio_chunks, media_type=audio_mime, headers=_meta_headers(req_id, out))
 
-    except BadRequestError as e:
-        # Voice/param issues — prints exact error to Render logs.
-        print(f"❌ /dispatch req_id={req_id} bad_request: {e}")
-        raise HTTPException(status_code=400, detail="Bad request to speech service")
+        if body == "multipart":
+            boundary = uuid.uuid4().hex
+            return StreamingResponse(
+                _multipart_body(boundary, out.model_dump(exclude={"audio_b64"}), audio_chunks, audio_mime),
+                media_type=f"multipart/mixed; boundary={boundary}",
+            )
 
-    except HTTPException:
-        print(f"⚠️ /dispatch req_id={req_id} HTTPException")
-        raise
+        return out
 
     except Exception as e:
-        print(f"❌ /dispatch req_id={req_id} error={type(e).__name__} msg={str(e)[:200]}")
-        raise HTTPException(status_code=500, detail=f"Dispatch error: {type(e).__name__}")
+        raise _http_error("/dispatch", req_id, e)
 
-    finally:
-        if tmp_path:
-            try:
-                os.remove(tmp_path)
-            except Exception:
-                pass
+
+@app.post("/dispatch/stream")
+async def dispatch_stream(
+    mode: str = Form("talk"),
+    audio: UploadFile = File(...),
+    voice: str = Form("nova"),
+    tts: str = Form("1"),
+):
+    """
+    Streaming variant of /dispatch. Same form fields; the body is NDJSON:
+      {"type": "transcript", "transcript": ..., "action": ...}
+      {"type": "text_delta", "delta": ...}                      (many)
+      {"type": "audio_chunk_b64", "seq": n, "audio_b64": ...}   (one per sentence, in order)
+      {"type": "done", "reply": ...} or {"type": "error", ...}
+    """
+    req_id = uuid.uuid4().hex
+    t0 = time.time()
+
+    _check_upload_ext(audio)
+
+    try:
+        _check_upload_size(audio)
+        transcript = await _transcribe(audio)
+
+    except Exception as e:
+        raise _http_error("/dispatch/stream", req_id, e)
+
+    action, bare = parse_action(transcript)
+    _save_feedback_action(action, transcript, req_id)
+    canned = bool(action and bare and action.name in CONTROL_ACTIONS)
+
+    return StreamingResponse(
+        _stream_reply(req_id, t0, transcript, action, canned, mode, voice, tts.strip() != "0"),
+        media_type="application/x-ndjson",
+    )
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# server.py builds its OpenAI client at import; no request is ever sent in tests
+os.environ.setdefault("OPENAI_API_KEY", "test")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,96 @@
+import pytest
+
+from server import NO_SPEECH_TRANSCRIPT, parse_action
+
+
+def _parsed(transcript):
+    action, _ = parse_action(transcript)
+    return (action.name, action.args) if action else None
+
+
+@pytest.mark.parametrize(
+    "transcript, expected",
+    [
+        # Fixed phrases
+        ("repeat that", ("repeat_last", {})),
+        ("Say that again please", ("repeat_last", {})),
+        ("help me", ("help", {})),
+        ("What can I say?", ("help", {})),
+        ("turn off speech", ("set_tts", {"enabled": False})),
+        ("mute dispatch voice", ("set_tts", {"enabled": False})),
+        ("Unmute dispatch voice", ("set_tts", {"enabled": True})),
+        ("speech on", ("set_tts", {"enabled": True})),
+        ("volume up", ("adjust_volume", {"delta": 0.1})),
+        ("Turn it DOWN", ("adjust_volume", {"delta": -0.1})),
+        ("louder please", ("adjust_volume", {"delta": 0.1})),
+        ("repeat the volume up", ("repeat_last", {})),
+        ("again please louder", ("repeat_last", {})),
+        # IGNORECASE matches these as "i"
+        ("WHAT CAN İ SAY", ("help", {})),
+        ("turn ıt up", ("adjust_volume", {"delta": 0.1})),
+        # Absolute volume
+        ("set volume to 70%", ("set_volume", {"value": 0.7})),
+        ("volume 60", ("set_volume", {"value": 0.6})),
+        ("Set volume to 60.", ("set_volume", {"value": 0.6})),
+        ("volume 250", ("set_volume", {"value": 1.0})),
+        ("volume to 0.6", ("set_volume", {"value": 0.6})),
+        ("volume .5", ("set_volume", {"value": 0.5})),
+        ("volume 1", ("set_volume", {"value": 1.0})),
+        ("volume 1.0", ("set_volume", {"value": 1.0})),
+        ("volume 60.5", ("set_volume", {"value": 0.605})),
+        ("volume 100.0", ("set_volume", {"value": 1.0})),
+        ("set volume to 55.5%", ("set_volume", {"value": 0.555})),
+        ("volume 1000", ("set_volume", {"value": 1.0})),
+        # Voice
+        ("use voice alloy", ("set_voice", {"voice": "alloy"})),
+        ("Switch VOICE to Nova", ("set_voice", {"voice": "nova"})),
+        ("voice = shimmer", ("set_voice", {"voice": "shimmer"})),
+        # Feedback (the note claims the rest of the utterance)
+        ("feedback: The Button is hard", ("save_feedback", {"note": "The Button is hard"})),
+        ("Feedback the app crashed", ("save_feedback", {"note": "Feedback the app crashed"})),
+        ("give me feedback - ok", ("save_feedback", {"note": "ok"})),
+        ("feedback: switch voice to nova is broken", ("save_feedback", {"note": "switch voice to nova is broken"})),
+        ("feedback: volume 60 is too loud", ("save_feedback", {"note": "volume 60 is too loud"})),
+        # No command
+        (NO_SPEECH_TRANSCRIPT, None),
+        ("what's the weather", None),
+        ("", None),
+        ("   ", None),
+    ],
+)
+def test_parse_action(transcript, expected):
+    assert _parsed(transcript) == expected
+
+
+@pytest.mark.parametrize(
+    "transcript",
+    [
+        "help",
+        "Help.",
+        "What can I say?",
+        "repeat that please",
+        "louder",
+        "turn it up",
+        "ok dispatch, turn off speech",
+        "Set volume to 70%",
+        "switch voice to nova",
+    ],
+)
+def test_bare_command(transcript):
+    action, bare = parse_action(transcript)
+    assert action is not None and bare
+
+
+@pytest.mark.parametrize(
+    "transcript",
+    [
+        "Can you help me find the bus stop?",
+        "Please repeat it slowly",
+        "Describe the voice of the narrator",
+        "I have no speech therapy today",
+        "can you turn it up?",
+    ],
+)
+def test_command_inside_a_question_is_not_bare(transcript):
+    action, bare = parse_action(transcript)
+    assert action is not None and not bare